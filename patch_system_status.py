@@ -1,112 +1,97 @@
 #!/usr/bin/env python3
 
+import argparse
+import cProfile
 import requests
-import json
 import sys
-import os
 from datetime import datetime
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 
-class RedHatPatchAPI:
-    def __init__(self, client_id, client_secret):
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.token_url = "https://sso.redhat.com/auth/realms/redhat-external/protocol/openid-connect/token"
-        self.patch_api_url = "https://console.redhat.com/api/patch/v3/systems"
-        self.access_token = None
-    
-    def get_oauth_token(self):
-        """Refresh OAuth token using client credentials"""
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        data = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret
-        }
-        
-        try:
-            response = requests.post(self.token_url, headers=headers, data=data)
-            response.raise_for_status()
-            
-            token_data = response.json()
-            self.access_token = token_data.get('access_token')
-            return self.access_token
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error getting OAuth token: {e}")
-            return None
-    
-    def get_patch_systems(self):
-        """Fetch systems data from Red Hat Patch API"""
-        if not self.access_token:
-            print("No access token available. Please refresh token first.")
-            return []
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        try:
-            response = requests.get(self.patch_api_url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            systems = data.get('data', [])
-            return systems
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching patch systems: {e}")
-            return []
-    
-    def get_system_advisories(self, inventory_id):
-        """Fetch advisories for a specific system"""
-        if not self.access_token:
-            print("No access token available. Please refresh token first.")
-            return []
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
+from redhat_patch_client import MAX_WORKERS, RedHatPatchClient, decode_json, load_config
+
+# Maximum number of systems per bulk advisories request
+ADVISORY_BATCH_SIZE = 100
+
+# Fixed per-OS table geometry; explicit row heights let ReportLab skip
+# measuring every cell when laying out and splitting long tables
+TABLE_COL_WIDTHS = [2.5*inch, 2*inch, 1*inch, 1.5*inch]
+TABLE_HEADER_HEIGHT = 27
+TABLE_ROW_HEIGHT = 18
+
+# Maximum number of systems per table before a group is split into several tables
+TABLE_MAX_ROWS = 500
+
+# Per-type installable advisory counts reported on each system by the Patch API
+INSTALLABLE_ADVISORY_COUNT_KEYS = (
+    'installable_rhsa_count',
+    'installable_rhba_count',
+    'installable_rhea_count',
+    'installable_other_count',
+)
+
+class RedHatPatchAPI(RedHatPatchClient):
+    def get_advisories_bulk(self, system_ids):
+        """Fetch advisory counts for many systems, one request per batch of systems
         
-        advisories_url = f"https://console.redhat.com/api/patch/v3/systems/{inventory_id}/advisories"
+        Raises RequestException if a batch fails or the API does not report
+        every requested system, so no system is silently counted as clean.
+        """
+        views_url = "https://console.redhat.com/api/patch/v3/views/systems/advisories"
+        advisory_counts = {}
         
         try:
-            response = requests.get(advisories_url, headers=headers)
-            response.raise_for_status()
+            for i in range(0, len(system_ids), ADVISORY_BATCH_SIZE):
+                batch = system_ids[i:i + ADVISORY_BATCH_SIZE]
+                offset = 0
+                
+                # Follow the view's own pagination until every system is in
+                while True:
+                    params = {'limit': len(batch), 'offset': offset}
+                    response = self.send_request('POST', views_url, params=params, json={'systems': batch})
+                    response.raise_for_status()
+                    
+                    # Response data maps each system ID to its list of advisory IDs
+                    data = decode_json(response)
+                    page = data.get('data') or {}
+                    for system_id, advisory_ids in page.items():
+                        advisory_counts[system_id] = len(advisory_ids or [])
+                    offset += len(page)
+                    
+                    total_items = (data.get('meta') or {}).get('total_items')
+                    if not page or total_items is None or offset >= total_items:
+                        break
+                
+                missing_ids = [system_id for system_id in batch if system_id not in advisory_counts]
+                if missing_ids:
+                    raise requests.exceptions.RequestException(
+                        f"no advisories returned for {len(missing_ids)} of {len(batch)} systems"
+                    )
             
-            data = response.json()
-            advisories = data.get('data', [])
-            return advisories
+            return advisory_counts
             
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching advisories for system {inventory_id}: {e}")
-            return []
+            print(f"Error fetching advisories for systems: {e}")
+            raise
 
-def load_config(config_file='config.json'):
-    """Load configuration from JSON file"""
-    try:
-        with open(config_file, 'r') as f:
-            config = json.load(f)
-        return config['redhat_api']['client_id'], config['redhat_api']['client_secret']
-    except FileNotFoundError:
-        print(f"Error: Configuration file '{config_file}' not found")
-        sys.exit(1)
-    except KeyError as e:
-        print(f"Error: Missing configuration key {e}")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in configuration file: {e}")
-        sys.exit(1)
+def get_installable_advisory_count(attributes):
+    """Sum the installable advisory counts reported in system attributes.
+    
+    Returns None if the attributes carry no installable counts at all;
+    keys that are present with a null value are treated as absent.
+    """
+    counts = [
+        attributes[key] for key in INSTALLABLE_ADVISORY_COUNT_KEYS
+        if attributes.get(key) is not None
+    ]
+    if not counts:
+        return None
+    return sum(counts)
 
 def get_system_status_data():
     """Fetch system data and organize by OS version"""
@@ -114,16 +99,45 @@ def get_system_status_data():
     
     api = RedHatPatchAPI(client_id, client_secret)
     
-    print("Refreshing OAuth token...")
+    print("Getting OAuth token...")
     token = api.get_oauth_token()
     if not token:
         print("Failed to get OAuth token")
         sys.exit(1)
     
-    print("Token refreshed successfully")
+    if api.token_from_cache:
+        print("Using cached OAuth token")
+    else:
+        print("Token refreshed successfully")
     
     print("Fetching patch systems data...")
-    systems = api.get_patch_systems()
+    
+    # Advisory counts normally come with the systems list; systems without
+    # them are looked up with one bulk advisories request per page, queued
+    # as soon as the page arrives
+    systems = []
+    pending_counts = []
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for page in api.iter_patch_systems():
+                systems.extend(page)
+                missing_ids = [
+                    system.get('id', 'No ID') for system in page
+                    if get_installable_advisory_count(system.get('attributes', {})) is None
+                ]
+                if missing_ids:
+                    pending_counts.append(executor.submit(api.get_advisories_bulk, missing_ids))
+    except requests.exceptions.RequestException:
+        print("Failed to retrieve the complete systems list")
+        sys.exit(1)
+    
+    fetched_counts = {}
+    try:
+        for future in pending_counts:
+            fetched_counts.update(future.result())
+    except requests.exceptions.RequestException:
+        print("Failed to retrieve advisory counts for every system")
+        sys.exit(1)
     
     if not systems:
         print("No systems data retrieved")
@@ -131,8 +145,8 @@ def get_system_status_data():
     
     print(f"Successfully retrieved {len(systems)} systems")
     
-    # Group systems by OS version
-    os_groups = defaultdict(list)
+    # Group systems by OS version, keeping per-group counts as we go
+    os_groups = {}
     
     for system in systems:
         attributes = system.get('attributes', {})
@@ -142,25 +156,79 @@ def get_system_status_data():
         
         print(f"Processing system: {display_name}")
         
-        # Get advisories for this system
-        advisories = api.get_system_advisories(system_id)
-        has_installable_advisories = len(advisories) > 0
+        advisory_count = get_installable_advisory_count(attributes)
+        if advisory_count is None:
+            advisory_count = fetched_counts[system_id]
+        has_installable_advisories = advisory_count > 0
         
         system_data = {
             'system_id': system_id,
             'display_name': display_name,
             'os_version': os_version,
             'has_installable_advisories': has_installable_advisories,
-            'advisory_count': len(advisories)
+            'advisory_count': advisory_count
         }
         
-        os_groups[os_version].append(system_data)
+        group = os_groups.setdefault(os_version, {'systems': [], 'count': 0, 'with_advisories': 0})
+        group['systems'].append(system_data)
+        group['count'] += 1
+        group['with_advisories'] += has_installable_advisories
     
-    return dict(os_groups)
+    # Sort each group once so every report can use it as-is
+    for group in os_groups.values():
+        group['systems'].sort(key=itemgetter('display_name'))
+    
+    return os_groups
 
-def generate_pdf_report(os_groups_data):
-    """Generate PDF report with system status grouped by OS version"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+def build_system_table(systems):
+    """Build a styled status table for the given systems, in order"""
+    # Create table data
+    table_data = [['System Name', 'System ID', 'Advisory Count', 'Status']]
+    
+    for system in systems:
+        status = "Has Advisories" if system['has_installable_advisories'] else "No Advisories"
+        table_data.append([
+            system['display_name'],
+            system['system_id'][:20] + '...' if len(system['system_id']) > 20 else system['system_id'],
+            str(system['advisory_count']),
+            status
+        ])
+    
+    # Create and style table
+    row_heights = [TABLE_HEADER_HEIGHT] + [TABLE_ROW_HEIGHT] * (len(table_data) - 1)
+    table = Table(table_data, colWidths=TABLE_COL_WIDTHS, rowHeights=row_heights)
+    
+    # Alternating row colors go in the same style list as everything else
+    row_styles = [
+        ('BACKGROUND', (0, i), (-1, i), colors.lightgrey)
+        for i in range(2, len(table_data), 2)
+    ]
+    
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        *row_styles,
+    ]))
+    
+    return table
+
+def generate_pdf_report(os_groups_data, profile=False):
+    """Generate PDF report with system status grouped by OS version
+    
+    With profile=True, the PDF build is run under cProfile and the stats are
+    saved next to the report for inspection with pstats or snakeviz.
+    """
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
     filename = f"patch_system_status_{timestamp}.pdf"
     
     # Create PDF document
@@ -190,34 +258,33 @@ def generate_pdf_report(os_groups_data):
     story.append(title)
     
     # Add generation timestamp
-    timestamp_text = f"Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    timestamp_text = f"Report generated on: {now:%Y-%m-%d %H:%M:%S}"
     timestamp_para = Paragraph(timestamp_text, styles['Normal'])
     story.append(timestamp_para)
     story.append(Spacer(1, 20))
     
     # Calculate overall statistics
-    total_systems = sum(len(systems) for systems in os_groups_data.values())
-    total_with_advisories = sum(
-        sum(1 for system in systems if system['has_installable_advisories'])
-        for systems in os_groups_data.values()
-    )
+    total_systems = sum(group['count'] for group in os_groups_data.values())
+    total_with_advisories = sum(group['with_advisories'] for group in os_groups_data.values())
     overall_percentage = (total_with_advisories / total_systems * 100) if total_systems > 0 else 0
     
     # Add overall summary
-    summary_text = f"<b>Overall Summary:</b><br/>"
-    summary_text += f"Total Systems: {total_systems}<br/>"
-    summary_text += f"Systems with Installable Advisories: {total_with_advisories}<br/>"
-    summary_text += f"Percentage with Advisories: {overall_percentage:.1f}%"
+    summary_text = (
+        f"<b>Overall Summary:</b><br/>"
+        f"Total Systems: {total_systems}<br/>"
+        f"Systems with Installable Advisories: {total_with_advisories}<br/>"
+        f"Percentage with Advisories: {overall_percentage:.1f}%"
+    )
     
     summary_para = Paragraph(summary_text, styles['Normal'])
     story.append(summary_para)
     story.append(Spacer(1, 20))
     
     # Process each OS version group
-    for os_version, systems in sorted(os_groups_data.items()):
+    for os_version, group in sorted(os_groups_data.items()):
         # Calculate statistics for this group
-        total_in_group = len(systems)
-        with_advisories = sum(1 for system in systems if system['has_installable_advisories'])
+        total_in_group = group['count']
+        with_advisories = group['with_advisories']
         percentage = (with_advisories / total_in_group * 100) if total_in_group > 0 else 0
         
         # Add group header
@@ -225,47 +292,26 @@ def generate_pdf_report(os_groups_data):
         header_para = Paragraph(group_header, heading_style)
         story.append(header_para)
         
-        # Create table data
-        table_data = [['System Name', 'System ID', 'Advisory Count', 'Status']]
-        
-        for system in sorted(systems, key=lambda x: x['display_name']):
-            status = "Has Advisories" if system['has_installable_advisories'] else "No Advisories"
-            table_data.append([
-                system['display_name'],
-                system['system_id'][:20] + '...' if len(system['system_id']) > 20 else system['system_id'],
-                str(system['advisory_count']),
-                status
-            ])
+        # Long groups are split into several tables that each repeat the
+        # header, since ReportLab's layout cost grows faster than row count
+        systems = group['systems']
+        for start in range(0, len(systems), TABLE_MAX_ROWS):
+            if start:
+                story.append(Spacer(1, 6))
+            story.append(build_system_table(systems[start:start + TABLE_MAX_ROWS]))
         
-        # Create and style table
-        table = Table(table_data, colWidths=[2.5*inch, 2*inch, 1*inch, 1.5*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ]))
-        
-        # Add alternating row colors
-        for i in range(1, len(table_data)):
-            if i % 2 == 0:
-                table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, i), (-1, i), colors.lightgrey)
-                ]))
-        
-        story.append(table)
         story.append(Spacer(1, 20))
     
     # Build PDF
     try:
-        doc.build(story)
+        if profile:
+            with cProfile.Profile() as profiler:
+                doc.build(story)
+            profile_filename = f"patch_system_status_{timestamp}.prof"
+            profiler.dump_stats(profile_filename)
+            print(f"PDF build profile saved to: {profile_filename}")
+        else:
+            doc.build(story)
         print(f"\nPDF report generated successfully: {filename}")
         return filename
     except Exception as e:
@@ -273,6 +319,11 @@ def generate_pdf_report(os_groups_data):
         return None
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate a PDF report of Red Hat system patch status")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the PDF build and save cProfile stats next to the report")
+    args = parser.parse_args()
+    
     print("Red Hat System Patch Status Report Generator")
     print("=" * 50)
     
@@ -288,9 +339,9 @@ def main():
     print("SYSTEM STATUS SUMMARY BY OS VERSION")
     print("=" * 50)
     
-    for os_version, systems in sorted(os_groups_data.items()):
-        total_in_group = len(systems)
-        with_advisories = sum(1 for system in systems if system['has_installable_advisories'])
+    for os_version, group in sorted(os_groups_data.items()):
+        total_in_group = group['count']
+        with_advisories = group['with_advisories']
         percentage = (with_advisories / total_in_group * 100) if total_in_group > 0 else 0
         
         print(f"\n{os_version}:")
@@ -298,13 +349,13 @@ def main():
         print(f"  Systems with advisories: {with_advisories}")
         print(f"  Percentage with advisories: {percentage:.1f}%")
         
-        for system in sorted(systems, key=lambda x: x['display_name']):
+        for system in group['systems']:
             status = "✓" if system['has_installable_advisories'] else "✗"
             print(f"    {status} {system['display_name']} ({system['advisory_count']} advisories)")
     
     # Generate PDF report
     print(f"\nGenerating PDF report...")
-    pdf_filename = generate_pdf_report(os_groups_data)
+    pdf_filename = generate_pdf_report(os_groups_data, profile=args.profile)
     
     if pdf_filename:
         print(f"Report generation completed successfully!")
@@ -4,145 +4,150 @@ import requests
 import json
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-class RedHatPatchAPI:
+from redhat_patch_client import (
+    MAX_WORKERS, RedHatPatchClient, decode_json, load_config, orjson, write_private_json
+)
+
+# Per-system advisories are cached here between runs; entries younger than the
+# TTL are reused as-is, older ones are revalidated with their ETag
+ADVISORY_CACHE_FILE = os.path.expanduser('~/.cache/rh_patch_advisories.json')
+ADVISORY_CACHE_TTL = 3600
+
+class RedHatPatchAPI(RedHatPatchClient):
     def __init__(self, client_id, client_secret):
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.token_url = "https://sso.redhat.com/auth/realms/redhat-external/protocol/openid-connect/token"
-        self.patch_api_url = "https://console.redhat.com/api/patch/v3/systems"
-        self.access_token = None
-    
-    def get_oauth_token(self):
-        """Refresh OAuth token using client credentials"""
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        data = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret
-        }
+        super().__init__(client_id, client_secret)
         
+        # Advisories cached by a previous run, and the entries to save for the next one
+        self.cached_advisories = self.load_advisory_cache()
+        self.fresh_advisories = {}
+    
+    def load_advisory_cache(self):
+        """Load per-system advisories cached by a previous run"""
         try:
-            response = requests.post(self.token_url, headers=headers, data=data)
-            response.raise_for_status()
-            
-            token_data = response.json()
-            self.access_token = token_data.get('access_token')
-            return self.access_token
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error getting OAuth token: {e}")
-            return None
+            with open(ADVISORY_CACHE_FILE, 'r') as f:
+                cache = json.load(f)
+            # Skip malformed entries so they are refetched rather than
+            # failing inside a worker thread
+            return {
+                system_id: entry for system_id, entry in cache.items()
+                if isinstance(entry, dict)
+                and isinstance(entry.get('fetched_at'), (int, float))
+                and isinstance(entry.get('advisories'), list)
+                and isinstance(entry.get('etag'), (str, type(None)))
+            }
+        except (OSError, ValueError, AttributeError, TypeError):
+            return {}
     
-    def get_patch_systems(self):
-        """Fetch systems data from Red Hat Patch API"""
-        if not self.access_token:
-            print("No access token available. Please refresh token first.")
-            return []
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
+    def save_advisory_cache(self):
+        """Persist the advisories looked up in this run for the next one"""
         try:
-            response = requests.get(self.patch_api_url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            systems = data.get('data', [])
-            return systems
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching patch systems: {e}")
-            return []
+            write_private_json(ADVISORY_CACHE_FILE, self.fresh_advisories)
+        except OSError as e:
+            print(f"Warning: could not cache advisories: {e}")
     
     def get_system_advisories(self, inventory_id):
-        """Fetch advisories for a specific system"""
+        """Fetch advisories for a specific system, reusing cached results while fresh"""
         if not self.access_token:
             print("No access token available. Please refresh token first.")
             return []
         
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
+        cached = self.cached_advisories.get(inventory_id)
+        if cached and time.time() < cached['fetched_at'] + ADVISORY_CACHE_TTL:
+            self.fresh_advisories[inventory_id] = cached
+            return cached['advisories']
         
         advisories_url = f"https://console.redhat.com/api/patch/v3/systems/{inventory_id}/advisories"
         
+        # Let the API answer 304 Not Modified if the cached advisories still hold
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        
         try:
-            response = requests.get(advisories_url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            advisories = data.get('data', [])
+            response = self.send_request('GET', advisories_url, headers=headers)
             
-            # Extract advisory IDs and synopsis
-            advisory_list = []
-            for advisory in advisories:
-                advisory_info = {
-                    'id': advisory.get('id', 'Unknown'),
-                    'synopsis': advisory.get('attributes', {}).get('synopsis', 'No synopsis')
-                }
-                advisory_list.append(advisory_info)
+            etag = response.headers.get('ETag')
+            if cached and response.status_code == 304:
+                advisory_list = cached['advisories']
+                # A 304 need not repeat the ETag; keep the one we validated with
+                etag = etag or cached.get('etag')
+            else:
+                response.raise_for_status()
+                
+                data = decode_json(response)
+                advisories = data.get('data', [])
+                
+                # Extract advisory IDs and synopsis
+                advisory_list = []
+                for advisory in advisories:
+                    advisory_info = {
+                        'id': advisory.get('id', 'Unknown'),
+                        'synopsis': advisory.get('attributes', {}).get('synopsis', 'No synopsis')
+                    }
+                    advisory_list.append(advisory_info)
             
+            self.fresh_advisories[inventory_id] = {
+                'fetched_at': time.time(),
+                'etag': etag,
+                'advisories': advisory_list
+            }
             return advisory_list
             
         except requests.exceptions.RequestException as e:
             print(f"Error fetching advisories for system {inventory_id}: {e}")
             return []
 
-def load_config(config_file='config.json'):
-    """Load configuration from JSON file"""
-    try:
-        with open(config_file, 'r') as f:
-            config = json.load(f)
-        return config['redhat_api']['client_id'], config['redhat_api']['client_secret']
-    except FileNotFoundError:
-        print(f"Error: Configuration file '{config_file}' not found")
-        sys.exit(1)
-    except KeyError as e:
-        print(f"Error: Missing configuration key {e}")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in configuration file: {e}")
-        sys.exit(1)
-
 def main():
     client_id, client_secret = load_config()
     
     api = RedHatPatchAPI(client_id, client_secret)
     
-    print("Refreshing OAuth token...")
+    print("Getting OAuth token...")
     token = api.get_oauth_token()
     if not token:
         print("Failed to get OAuth token")
         sys.exit(1)
     
-    print("Token refreshed successfully")
+    if api.token_from_cache:
+        print("Using cached OAuth token")
+    else:
+        print("Token refreshed successfully")
     
     print("Fetching patch systems data...")
-    systems = api.get_patch_systems()
+    
+    # Queue advisory fetches as each page of systems arrives so they overlap
+    # with fetching the remaining pages
+    systems = []
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for page in api.iter_patch_systems():
+                for system in page:
+                    future = executor.submit(api.get_system_advisories, system.get('id', 'No ID'))
+                    systems.append((system, future))
+    except requests.exceptions.RequestException:
+        print("Failed to retrieve the complete systems list")
+        sys.exit(1)
     
     systems_with_advisories = []
     
     if systems:
+        # Only a complete listing replaces the cache from the previous run
+        api.save_advisory_cache()
+        
         print(f"Successfully retrieved {len(systems)} systems")
         print("\nSystems data and advisories:")
         
-        for i, system in enumerate(systems):
+        for i, (system, future) in enumerate(systems):
+            advisories = future.result()
             display_name = system.get('attributes', {}).get('display_name', 'Unknown')
             system_id = system.get('id', 'No ID')
             
             print(f"\n{i+1}. {display_name} - {system_id}")
             
-            # Get advisories for this system
-            advisories = api.get_system_advisories(system_id)
-            
             system_data = {
                 'system_id': system_id,
                 'display_name': display_name,
@@ -213,8 +218,12 @@ def generate_json_report(systems_data):
         }
     
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(json_report, f, indent=2, ensure_ascii=False)
+        if orjson is not None:
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(json_report, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(json_report, f, indent=2, ensure_ascii=False)
         print(f"\nJSON report saved to: {filename}")
         return filename
     except Exception as e:
@@ -0,0 +1,224 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import json
+import sys
+import os
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Number of concurrent advisory requests against the Patch API
+MAX_WORKERS = 32
+
+# Access tokens are cached here between runs and reused until shortly before expiry
+TOKEN_CACHE_FILE = os.path.expanduser('~/.cache/rh_patch_token.json')
+TOKEN_EXPIRY_SKEW = 30
+
+def decode_json(response):
+    """Decode a JSON response body, using orjson when it is installed"""
+    if orjson is None:
+        return response.json()
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError as e:
+        raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos) from e
+
+def write_private_json(path, data):
+    """Write data as JSON to path, readable only by the current user"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        os.fchmod(f.fileno(), 0o600)
+        json.dump(data, f)
+
+class RedHatPatchClient:
+    """OAuth-authenticated client for the Red Hat Patch API shared by the report scripts"""
+    
+    def __init__(self, client_id, client_secret):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = "https://sso.redhat.com/auth/realms/redhat-external/protocol/openid-connect/token"
+        self.patch_api_url = "https://console.redhat.com/api/patch/v3/systems"
+        self.access_token = None
+        self.token_from_cache = False
+        self.token_lock = threading.Lock()
+        
+        # Reuse pooled keep-alive connections across all API calls, retrying
+        # throttled and transient server errors with exponential backoff.
+        # POST is included because the token and bulk advisories requests
+        # have no side effects.
+        self.session = requests.Session()
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {'POST'},
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(
+            pool_connections=MAX_WORKERS,
+            pool_maxsize=MAX_WORKERS,
+            max_retries=retry
+        )
+        self.session.mount('https://', adapter)
+    
+    def set_access_token(self, access_token):
+        """Use the given access token for all subsequent API calls"""
+        self.access_token = access_token
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        })
+    
+    def load_cached_token(self):
+        """Return the cached access token if it belongs to this client and is still valid"""
+        try:
+            with open(TOKEN_CACHE_FILE, 'r') as f:
+                cached = json.load(f)
+            if cached['client_id'] != self.client_id:
+                return None
+            if time.time() >= cached['expires_at'] - TOKEN_EXPIRY_SKEW:
+                return None
+            return cached['access_token']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    
+    def save_cached_token(self, access_token, expires_in):
+        """Persist the access token and its expiry time, readable only by the current user"""
+        cached = {
+            'client_id': self.client_id,
+            'access_token': access_token,
+            'expires_at': time.time() + expires_in
+        }
+        
+        try:
+            write_private_json(TOKEN_CACHE_FILE, cached)
+        except OSError as e:
+            print(f"Warning: could not cache OAuth token: {e}")
+    
+    def clear_cached_token(self):
+        """Remove the cached access token so the next run requests a new one"""
+        try:
+            os.remove(TOKEN_CACHE_FILE)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: could not remove cached OAuth token: {e}")
+    
+    def get_oauth_token(self):
+        """Get an access token, reusing a cached token while valid"""
+        cached_token = self.load_cached_token()
+        if cached_token:
+            self.set_access_token(cached_token)
+            self.token_from_cache = True
+            return self.access_token
+        
+        return self.refresh_oauth_token()
+    
+    def refresh_oauth_token(self):
+        """Refresh OAuth token using client credentials"""
+        self.token_from_cache = False
+        
+        # The session carries the Patch API bearer token; it must not be sent
+        # to the SSO token endpoint, so drop it from this request
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Authorization': None
+        }
+        
+        data = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret
+        }
+        
+        try:
+            response = self.session.post(self.token_url, headers=headers, data=data)
+            response.raise_for_status()
+            
+            token_data = response.json()
+            access_token = token_data.get('access_token')
+            if access_token:
+                self.set_access_token(access_token)
+                if 'expires_in' in token_data:
+                    self.save_cached_token(access_token, token_data['expires_in'])
+            return access_token
+            
+        except requests.exceptions.RequestException as e:
+            print(f"Error getting OAuth token: {e}")
+            return None
+    
+    def send_request(self, method, url, **kwargs):
+        """Send a Patch API request, replacing a rejected cached token once"""
+        rejected_token = self.access_token
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code != 401:
+            return response
+        
+        # A cached token may have been revoked before it expired; drop it and
+        # fetch a new one, unless another request has already done so
+        with self.token_lock:
+            if self.access_token == rejected_token:
+                if not self.token_from_cache:
+                    return response
+                print("Cached OAuth token was rejected, requesting a new one...")
+                self.clear_cached_token()
+                if not self.refresh_oauth_token():
+                    return response
+        
+        return self.session.request(method, url, **kwargs)
+    
+    def iter_patch_systems(self, page_size=100):
+        """Yield pages of systems from Red Hat Patch API as they arrive
+        
+        A failed page request is logged and re-raised, so callers never
+        mistake a partial listing for the whole fleet.
+        """
+        if not self.access_token:
+            print("No access token available. Please refresh token first.")
+            return
+        
+        offset = 0
+        
+        try:
+            while True:
+                params = {'limit': page_size, 'offset': offset}
+                response = self.send_request('GET', self.patch_api_url, params=params)
+                response.raise_for_status()
+                
+                data = decode_json(response)
+                page = data.get('data', [])
+                offset += len(page)
+                
+                if page:
+                    yield page
+                
+                # Stop on a short page or once every reported system is in
+                total_items = data.get('meta', {}).get('total_items')
+                if len(page) < page_size or (total_items is not None and offset >= total_items):
+                    break
+            
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching patch systems: {e}")
+            raise
+
+def load_config(config_file='config.json'):
+    """Load configuration from JSON file"""
+    try:
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        return config['redhat_api']['client_id'], config['redhat_api']['client_secret']
+    except FileNotFoundError:
+        print(f"Error: Configuration file '{config_file}' not found")
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Missing configuration key {e}")
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error: Invalid JSON in configuration file: {e}")
+        sys.exit(1)